@@ -1,7 +1,10 @@
 from os import getenv
+from os.path import join
+from tempfile import gettempdir
 
 gral_base_url = getenv("GRAL_BASE_URL") or "http://localhost:5000"
 gral_path = getenv("GRAL_PATH") or "D:\Minecraft Developement\GRAL"
+gral_cache_path = getenv("GRAL_CACHE_PATH") or join(gettempdir(), "visualizer-gral")
 
 postgres_host = getenv("POSTGRES_HOST") or "localhost"
 postgres_user = getenv("POSTGRES_USER") or "postgres"
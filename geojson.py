@@ -3,12 +3,14 @@ from typing import Dict, Any, List
 import numpy as np
 from pyproj import CRS
 from shapely.geometry import box, Point, mapping
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 import geopandas as gpd
 
-from models import ConcentrationInfo, PointSource, CadastreSource
-from processing import wgs84_point_to_crs, crs_point_to_wgs84
+from models import ConcentrationInfo, PointSource, CadastreSource, Map
+from processing import wgs84_point_to_crs, crs_point_to_wgs84, infer_cellsize, align_to_grid, compare_fields, \
+    grid_shift, COMPARE_OPERATIONS
 from util import MSK_48_CRS
 
 
@@ -58,6 +60,55 @@ def _swap_coords_geom(geom: Dict[str, Any]) -> Dict[str, Any]:
         return {"type": gtype, "coordinates": swap_any(coords)}
 
 
+def _concentration_cells_to_features(
+        lons: List[float],
+        lats: List[float],
+        props_list: List[Dict[str, Any]],
+        cell_size_m: float,
+        use_utm: bool,
+        drop_zero: bool,
+        swap_coords: bool
+) -> List[Dict[str, Any]]:
+    """
+    Строит квадраты cell_size_m x cell_size_m (в метрах) вокруг точек (lon, lat) в WGS84
+    и возвращает их как GeoJSON Feature типа concentration_cell со свойствами из props_list.
+    """
+    # Создаем GeoDataFrame точек в WGS84
+    gdf_pts = gpd.GeoDataFrame(geometry=[Point(xy) for xy in zip(lons, lats)], crs="EPSG:4326")
+
+    # Проекция для метрических операций
+    if use_utm:
+        center_lon = (min(lons) + max(lons)) / 2.0
+        center_lat = (min(lats) + max(lats)) / 2.0
+        proj_crs = _choose_project_crs_for_lonlat(center_lon, center_lat)
+    else:
+        proj_crs = CRS.from_epsg(3857)
+
+    gdf_m = gdf_pts.to_crs(proj_crs.to_string())
+
+    half = cell_size_m / 2.0
+    boxes = []
+    for geom in gdf_m.geometry:
+        cx, cy = geom.x, geom.y
+        b = box(cx - half, cy - half, cx + half, cy + half)
+        boxes.append(b)
+    gdf_m["geometry"] = boxes
+
+    # Обратно в EPSG:4326
+    gdf_out = gdf_m.to_crs("EPSG:4326")
+
+    features: List[Dict[str, Any]] = []
+    for props, cell in zip(props_list, gdf_out.geometry):
+        if drop_zero and props["value"] == 0.0:
+            continue
+        geom = mapping(cell)  # GeoJSON-like dict
+        if swap_coords:
+            geom = _swap_coords_geom(geom)
+        prop = {"type": "concentration_cell", **props}
+        features.append({"type": "Feature", "geometry": geom, "properties": prop})
+    return features
+
+
 def generate_geojson_for_map_timestamp(
         db_session: Session,
         map_id: int,
@@ -105,45 +156,7 @@ def generate_geojson_for_map_timestamp(
             "info_id": int(r.info_id) if hasattr(r, "info_id") else None,
         })
 
-    # Создаем GeoDataFrame точек в WGS84
-    gdf_pts = gpd.GeoDataFrame(props_list, geometry=[Point(xy) for xy in zip(lons, lats)], crs="EPSG:4326")
-
-    # Проекция для метрических операций
-    if use_utm:
-        center_lon = (min(lons) + max(lons)) / 2.0
-        center_lat = (min(lats) + max(lats)) / 2.0
-        proj_crs = _choose_project_crs_for_lonlat(center_lon, center_lat)
-    else:
-        proj_crs = CRS.from_epsg(3857)
-
-    gdf_m = gdf_pts.to_crs(proj_crs.to_string())
-
-    half = cell_size_m / 2.0
-    boxes = []
-    for geom in gdf_m.geometry:
-        cx, cy = geom.x, geom.y
-        b = box(cx - half, cy - half, cx + half, cy + half)
-        boxes.append(b)
-    gdf_m["geometry"] = boxes
-
-    # Обратно в EPSG:4326
-    gdf_out = gdf_m.to_crs("EPSG:4326")
-
-    features: List[Dict[str, Any]] = []
-    for _, row in gdf_out.iterrows():
-        if drop_zero and float(row["value"]) == 0.0:
-            continue
-        geom = mapping(row.geometry)  # GeoJSON-like dict
-        if swap_coords:
-            geom = _swap_coords_geom(geom)
-        prop = {
-            "type": "concentration_cell",
-            "value": row["value"],
-            "map_id": row["map_id"],
-            "timestamp": row["timestamp"],
-            "info_id": row.get("info_id"),
-        }
-        features.append({"type": "Feature", "geometry": geom, "properties": prop})
+    features = _concentration_cells_to_features(lons, lats, props_list, cell_size_m, use_utm, drop_zero, swap_coords)
 
     xllcorner = 0
     yllcorner = 0
@@ -179,3 +192,102 @@ def generate_geojson_for_map_timestamp(
 
     fc = {"type": "FeatureCollection", "features": features}
     return fc
+
+
+_aggregates = {"mean": func.avg, "max": func.max, "min": func.min}
+
+
+def _load_concentration_field(
+        db_session: Session,
+        map_id: int,
+        timestamp: str | None,
+        aggregate: str
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Загружает поле концентраций карты как массивы (lon, lat, value).
+    Если timestamp не указан, значения агрегируются по всем временным меткам в каждой ячейке.
+    """
+    x, y, value = ConcentrationInfo.x, ConcentrationInfo.y, ConcentrationInfo.value
+    if timestamp is not None:
+        query = db_session.query(x, y, value) \
+            .filter(ConcentrationInfo.map_id == map_id, ConcentrationInfo.timestamp == timestamp)
+    else:
+        query = db_session.query(x, y, _aggregates[aggregate](value)) \
+            .filter(ConcentrationInfo.map_id == map_id) \
+            .group_by(x, y)
+    field = np.array(query.all(), dtype=float).reshape(-1, 3)
+    return field[:, 0], field[:, 1], field[:, 2]
+
+
+def generate_geojson_for_map_comparison(
+        db_session: Session,
+        map_id: int,
+        other_map_id: int,
+        timestamp: str | None = None,
+        operation: str = "difference",
+        aggregate: str = "mean",
+        use_utm: bool = True,
+        drop_zero: bool = False,
+        swap_coords: bool = True
+) -> Dict[str, Any]:
+    """
+    Генерирует GeoJSON FeatureCollection с поячеечным сравнением двух карт:
+      - difference: value = map - other_map, ratio: value = map / other_map (null при делении на 0)
+      - сетка other_map приводится к сетке map по левым нижним углам (lbx, lby) обеих карт и шагу ячеек;
+        сдвиг между углами должен быть кратен шагу
+      - сравниваются только ячейки, присутствующие на обеих картах
+    Параметры:
+      - timestamp: временная метка; если не указана — сравниваются агрегаты по всем меткам
+      - aggregate: агрегат по временным меткам (mean, max, min)
+    Остальные параметры как в generate_geojson_for_map_timestamp.
+    ValueError, если сетки карт несовместимы или параметры неизвестны.
+    """
+    if operation not in COMPARE_OPERATIONS:
+        raise ValueError(f"Unknown operation: {operation}")
+    if aggregate not in _aggregates:
+        raise ValueError(f"Unknown aggregate: {aggregate}")
+
+    map_a = db_session.query(Map).filter(Map.map_id == map_id).one()
+    map_b = db_session.query(Map).filter(Map.map_id == other_map_id).one()
+
+    lons_a, lats_a, values_a = _load_concentration_field(db_session, map_id, timestamp, aggregate)
+    lons_b, lats_b, values_b = _load_concentration_field(db_session, other_map_id, timestamp, aggregate)
+    if not lons_a.size or not lons_b.size:
+        return {"type": "FeatureCollection", "features": []}
+
+    cellsize = infer_cellsize(lons_a, lats_a, MSK_48_CRS)
+    other_cellsize = infer_cellsize(lons_b, lats_b, MSK_48_CRS, default=cellsize)
+    if cellsize != other_cellsize:
+        raise ValueError(f"Maps have different cell sizes: {cellsize} and {other_cellsize}")
+
+    # Каждая карта переводится в индексы своей сетки, затем сетка other_map_id сдвигается на целое число ячеек
+    # к сетке map_id
+    left_bottom = (map_a.lbx, map_a.lby)
+    other_left_bottom = (map_b.lbx, map_b.lby)
+    shift_columns, shift_rows = grid_shift(left_bottom, other_left_bottom, MSK_48_CRS, cellsize)
+    columns_a, rows_a = align_to_grid(lons_a, lats_a, MSK_48_CRS, left_bottom, cellsize)
+    columns_b, rows_b = align_to_grid(lons_b, lats_b, MSK_48_CRS, other_left_bottom, cellsize)
+    columns_b += shift_columns
+    rows_b += shift_rows
+
+    index_a, index_b, result = compare_fields(columns_a, rows_a, values_a, columns_b, rows_b, values_b, operation)
+    if not result.size:
+        return {"type": "FeatureCollection", "features": []}
+
+    props_list = [
+        {
+            "value": None if np.isnan(value) else float(value),
+            "value_a": float(a),
+            "value_b": float(b),
+            "map_id": map_id,
+            "other_map_id": other_map_id,
+            "timestamp": timestamp,
+            "aggregate": None if timestamp is not None else aggregate,
+            "operation": operation,
+        }
+        for value, a, b in zip(result, values_a[index_a], values_b[index_b])
+    ]
+
+    features = _concentration_cells_to_features(lons_a[index_a].tolist(), lats_a[index_a].tolist(), props_list,
+                                                cellsize, use_utm, drop_zero, swap_coords)
+    return {"type": "FeatureCollection", "features": features}
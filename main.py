@@ -1,24 +1,26 @@
 import os.path
 import re
 from io import StringIO
-from tempfile import TemporaryFile, TemporaryDirectory
+from tempfile import TemporaryDirectory
 from typing import Annotated, List
 from zipfile import ZipFile
 
 import pandas
 import sqlalchemy
 from fastapi import FastAPI, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from geopandas import GeoDataFrame
 from sqlalchemy import select, Sequence, delete
+from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm import Session
 
-from config import postgres_url, gral_path, gral_base_url
-from geojson import generate_geojson_for_map_timestamp
+from config import postgres_url, gral_path, gral_base_url, gral_cache_path
+from geojson import generate_geojson_for_map_timestamp, generate_geojson_for_map_comparison
 from models import Base, PointSource, CadastreSource, Map, ConcentrationInfo
 from processing import read_grid_to_geodataframe
 from util import df_to_objects, point_to_dict, cadastre_to_dict, cadastre_order, point_order, cadastre_original_headers, \
-    point_original_headers, download_file, timestamp_regex, normalize_columns, MSK_48_CRS
+    point_original_headers, download_file, file_lock, timestamp_regex, normalize_columns, MSK_48_CRS
 
 app = FastAPI()
 engine = sqlalchemy.create_engine(postgres_url)
@@ -122,10 +124,13 @@ async def process(map_id: int):
 
             resulting_frames: List[tuple[str, GeoDataFrame]] = []
 
+            # Архив кэшируется между запусками: если он не изменился на сервере, повторно не скачивается
+            archive_path = os.path.join(gral_cache_path, "gralfile.zip")
+            await run_in_threadpool(download_file, f"{gral_base_url}/gralfile", archive_path)
+
             with TemporaryDirectory() as tmpdir:
-                with TemporaryFile() as tmpfile:
-                    download_file(f"{gral_base_url}/gralfile", tmpfile)
-                    zf = ZipFile(tmpfile)
+                # Разделяемая блокировка: другой воркер не заменит архив, пока он распаковывается
+                with file_lock(archive_path, exclusive=False), ZipFile(archive_path) as zf:
                     zf.extractall(tmpdir)
 
                     for file in zf.infolist():
@@ -183,4 +188,26 @@ async def generate_geojson_timestamp(map_id: int, timestamp: str):
 
             map_timestamp = generate_geojson_for_map_timestamp(session, map_id, timestamp, left_bottom = (map.lbx, map.lby))
             geojson_cache[f'{map_id}-{timestamp}'] = map_timestamp
-            return map_timestamp
\ No newline at end of file
+            return map_timestamp
+
+@app.get("/compare_maps")
+async def compare_maps(map_id: int,
+                       other_map_id: int,
+                       timestamp: str | None = None,
+                       operation: str = "difference",
+                       aggregate: str = "mean"):
+    # Агрегат используется только без временной метки
+    key = f'compare-{map_id}-{other_map_id}-{timestamp if timestamp is not None else "all-" + aggregate}-{operation}'
+    if key in geojson_cache:
+        return geojson_cache[key]
+    else:
+        with Session(engine) as session:
+            try:
+                comparison = generate_geojson_for_map_comparison(session, map_id, other_map_id, timestamp,
+                                                                 operation=operation, aggregate=aggregate)
+            except NoResultFound:
+                raise HTTPException(status_code=404, detail="Map not found")
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            geojson_cache[key] = comparison
+            return comparison
@@ -1,8 +1,11 @@
 import geopandas
+import numpy as np
 import pyproj
-from typing import cast
+from typing import cast, Final
 from shapely import Point
 
+COMPARE_OPERATIONS: Final[tuple[str, ...]] = ("difference", "ratio")
+
 def wgs84_point_to_crs(point: tuple[float, float], crs: str) -> tuple[float, float]:
     """
     Проецирует точку из WGS84 в указанную CRS
@@ -102,3 +105,120 @@ def read_grid_to_geodataframe(path: str,
             "unit": unit
         }
         return geo_df, metadata
+
+
+def infer_cellsize(lons: np.ndarray, lats: np.ndarray, target_crs: str, default: float = 200.0) -> float:
+    """
+    Определяет шаг сетки по координатам её узлов
+
+    @param lons: Долготы узлов сетки в WGS84
+    @param lats: Широты узлов сетки в WGS84
+    @param target_crs: Метрическая система координат, в которой построена сетка
+    @param default: Шаг, возвращаемый для сетки из одного узла
+    @return: Шаг сетки в метрах
+    """
+    x, y = pyproj.Transformer.from_crs('EPSG:4326', target_crs, always_xy=True).transform(lons, lats, errcheck=True)
+    for axis in (np.asarray(x), np.asarray(y)):
+        steps = np.diff(np.unique(np.round(axis, 1)))
+        if steps.size:
+            return float(np.round(np.median(steps)))
+    return default
+
+
+def align_to_grid(lons: np.ndarray,
+                  lats: np.ndarray,
+                  target_crs: str,
+                  left_bottom: tuple[float, float],
+                  cellsize: float,
+                  tolerance: float = 1e-3) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Переводит точки из WGS84 в индексы (столбец, строка) сетки с указанным левым нижним углом и шагом
+
+    Parameters
+    ----------
+    lons, lats - Координаты точек в WGS84
+    target_crs - Метрическая система координат, в которой построена сетка
+    left_bottom - Координаты левого нижнего угла сетки в системе WGS84
+    cellsize - Шаг сетки в метрах
+    tolerance - Допустимое смещение точки от узла сетки, в долях шага (погрешность перепроецирования)
+
+    Returns
+    -------
+    Массивы индексов столбцов и строк; ValueError, если точки не совпадают с узлами сетки
+    """
+    transformer = pyproj.Transformer.from_crs('EPSG:4326', target_crs, always_xy=True)
+    x, y = transformer.transform(lons, lats, errcheck=True)
+    xllcorner, yllcorner = wgs84_point_to_crs(left_bottom, target_crs)
+
+    columns = (np.asarray(x) - xllcorner) / cellsize
+    rows = (np.asarray(y) - yllcorner) / cellsize
+    offset = np.maximum(np.abs(columns - np.round(columns)), np.abs(rows - np.round(rows)))
+    if offset.size and offset.max() > tolerance:
+        raise ValueError(f"Grid is not aligned: nodes are offset by up to {offset.max() * cellsize:.1f} m")
+    return np.round(columns).astype(np.int64), np.round(rows).astype(np.int64)
+
+
+def grid_shift(left_bottom: tuple[float, float],
+               other_left_bottom: tuple[float, float],
+               target_crs: str,
+               cellsize: float,
+               tolerance: float = 1e-3) -> tuple[int, int]:
+    """
+    Сдвиг сетки с левым нижним углом other_left_bottom относительно сетки с углом left_bottom, в ячейках
+
+    Parameters
+    ----------
+    left_bottom, other_left_bottom - Координаты левых нижних углов сеток в системе WGS84
+    target_crs - Метрическая система координат, в которой построены сетки
+    cellsize - Шаг обеих сеток в метрах
+    tolerance - Допустимое отклонение сдвига от целого числа ячеек, в долях шага
+
+    Returns
+    -------
+    Сдвиг по столбцам и строкам; ValueError, если сдвиг не кратен шагу сетки
+    """
+    xllcorner, yllcorner = wgs84_point_to_crs(left_bottom, target_crs)
+    other_xllcorner, other_yllcorner = wgs84_point_to_crs(other_left_bottom, target_crs)
+    shift = np.array([other_xllcorner - xllcorner, other_yllcorner - yllcorner]) / cellsize
+    if np.abs(shift - np.round(shift)).max() > tolerance:
+        raise ValueError(f"Grids are not aligned: origins differ by "
+                         f"({shift[0] * cellsize:.1f}, {shift[1] * cellsize:.1f}) m, "
+                         f"which is not a multiple of cell size {cellsize}")
+    return int(np.round(shift[0])), int(np.round(shift[1]))
+
+
+def compare_fields(columns_a: np.ndarray, rows_a: np.ndarray, values_a: np.ndarray,
+                   columns_b: np.ndarray, rows_b: np.ndarray, values_b: np.ndarray,
+                   operation: str = "difference") -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Поячеечное сравнение двух полей на общей сетке: difference = a - b, ratio = a / b.
+    Сравниваются только ячейки, присутствующие в обоих полях.
+    Каждая ячейка должна встречаться в поле не более одного раза: несколько значений в одной ячейке
+    (например, файлы разных групп источников с одной временной меткой) не сводятся к одному,
+    а приводят к ValueError
+
+    Returns
+    -------
+    Индексы общих ячеек в поле a, индексы в поле b и значения результата (NaN, если отношение не определено)
+    """
+    if operation not in COMPARE_OPERATIONS:
+        raise ValueError(f"Unknown operation: {operation}")
+
+    # Пара (столбец, строка) кодируется одним числом для векторного пересечения
+    offset = min(columns_a.min(initial=0), columns_b.min(initial=0), rows_a.min(initial=0), rows_b.min(initial=0))
+    width = max(columns_a.max(initial=0), columns_b.max(initial=0)) - offset + 1
+    keys_a = (rows_a - offset) * width + (columns_a - offset)
+    keys_b = (rows_b - offset) * width + (columns_b - offset)
+    for name, keys in (("first", keys_a), ("second", keys_b)):
+        _, counts = np.unique(keys, return_counts=True)
+        if counts.size and counts.max() > 1:
+            raise ValueError(f"The {name} field has {np.count_nonzero(counts > 1)} cells with several values")
+    _, index_a, index_b = np.intersect1d(keys_a, keys_b, assume_unique=True, return_indices=True)
+
+    a = values_a[index_a]
+    b = values_b[index_b]
+    if operation == "difference":
+        result = a - b
+    else:
+        result = np.divide(a, b, out=np.full(a.shape, np.nan), where=b != 0)
+    return index_a, index_b, result
@@ -0,0 +1,98 @@
+import numpy as np
+import pyproj
+import pytest
+
+from processing import infer_cellsize, align_to_grid, grid_shift, compare_fields, wgs84_point_to_crs
+from util import MSK_48_CRS
+
+LEFT_BOTTOM = (39.5, 52.6)
+CELLSIZE = 200.0
+
+_to_wgs84 = pyproj.Transformer.from_crs(MSK_48_CRS, 'EPSG:4326', always_xy=True)
+
+
+def _origin(shift_x: float = 0.0, shift_y: float = 0.0) -> tuple[float, float]:
+    """Левый нижний угол в WGS84, смещённый от LEFT_BOTTOM на shift_x, shift_y метров в MSK-48"""
+    x, y = wgs84_point_to_crs(LEFT_BOTTOM, MSK_48_CRS)
+    return _to_wgs84.transform(x + shift_x, y + shift_y)
+
+
+def _grid(left_bottom: tuple[float, float], ncols: int, nrows: int) -> tuple[np.ndarray, np.ndarray]:
+    """Узлы сетки ncols x nrows в WGS84, построенные как в read_grid_to_geodataframe"""
+    x, y = wgs84_point_to_crs(left_bottom, MSK_48_CRS)
+    columns, rows = np.meshgrid(np.arange(ncols), np.arange(nrows))
+    lons, lats = _to_wgs84.transform(x + columns.ravel() * CELLSIZE, y + rows.ravel() * CELLSIZE)
+    return np.asarray(lons), np.asarray(lats)
+
+
+def test_infer_cellsize():
+    lons, lats = _grid(LEFT_BOTTOM, 5, 4)
+    assert infer_cellsize(lons, lats, MSK_48_CRS) == CELLSIZE
+    assert infer_cellsize(lons[:1], lats[:1], MSK_48_CRS, default=50.0) == 50.0
+
+
+def test_align_to_grid():
+    lons, lats = _grid(LEFT_BOTTOM, 3, 2)
+    columns, rows = align_to_grid(lons, lats, MSK_48_CRS, LEFT_BOTTOM, CELLSIZE)
+    assert columns.tolist() == [0, 1, 2, 0, 1, 2]
+    assert rows.tolist() == [0, 0, 0, 1, 1, 1]
+
+
+def test_align_to_grid_rejects_offset_nodes():
+    lons, lats = _grid(_origin(40.0), 3, 2)
+    with pytest.raises(ValueError, match="not aligned"):
+        align_to_grid(lons, lats, MSK_48_CRS, LEFT_BOTTOM, CELLSIZE)
+
+
+def test_grid_shift():
+    assert grid_shift(LEFT_BOTTOM, _origin(400.0, -200.0), MSK_48_CRS, CELLSIZE) == (2, -1)
+    assert grid_shift(LEFT_BOTTOM, LEFT_BOTTOM, MSK_48_CRS, CELLSIZE) == (0, 0)
+
+
+def test_grid_shift_rejects_non_multiple_origin():
+    with pytest.raises(ValueError, match="not aligned"):
+        grid_shift(LEFT_BOTTOM, _origin(40.0), MSK_48_CRS, CELLSIZE)
+
+
+def test_compare_shifted_grids():
+    other_left_bottom = _origin(400.0, -200.0)
+    lons_a, lats_a = _grid(LEFT_BOTTOM, 5, 4)
+    lons_b, lats_b = _grid(other_left_bottom, 3, 3)
+    values_a = np.arange(20, dtype=float)
+    values_b = np.full(9, 1.0)
+
+    columns_a, rows_a = align_to_grid(lons_a, lats_a, MSK_48_CRS, LEFT_BOTTOM, CELLSIZE)
+    columns_b, rows_b = align_to_grid(lons_b, lats_b, MSK_48_CRS, other_left_bottom, CELLSIZE)
+    shift_columns, shift_rows = grid_shift(LEFT_BOTTOM, other_left_bottom, MSK_48_CRS, CELLSIZE)
+    columns_b += shift_columns
+    rows_b += shift_rows
+
+    # Строка 0 сетки b после сдвига получает индекс -1 и не пересекается с сеткой a
+    index_a, index_b, result = compare_fields(columns_a, rows_a, values_a, columns_b, rows_b, values_b)
+    assert sorted(zip(columns_a[index_a].tolist(), rows_a[index_a].tolist())) == \
+        [(2, 0), (2, 1), (3, 0), (3, 1), (4, 0), (4, 1)]
+    np.testing.assert_array_equal(columns_a[index_a], columns_b[index_b])
+    np.testing.assert_array_equal(rows_a[index_a], rows_b[index_b])
+    np.testing.assert_array_equal(result, values_a[index_a] - 1.0)
+
+
+def test_compare_ratio_division_by_zero():
+    columns = np.array([0, 1, 2])
+    rows = np.zeros(3, dtype=np.int64)
+    _, _, result = compare_fields(columns, rows, np.array([4.0, 0.0, 3.0]),
+                                  columns, rows, np.array([2.0, 0.0, 0.0]), operation="ratio")
+    assert result[0] == 2.0
+    assert np.isnan(result[1:]).all()
+
+
+def test_compare_rejects_duplicate_cells():
+    columns = np.array([0, 0])
+    rows = np.array([0, 0])
+    with pytest.raises(ValueError, match="several values"):
+        compare_fields(columns, rows, np.array([1.0, 2.0]), columns[:1], rows[:1], np.array([1.0]))
+
+
+def test_compare_rejects_unknown_operation():
+    columns = np.array([0])
+    with pytest.raises(ValueError, match="Unknown operation"):
+        compare_fields(columns, columns, np.array([1.0]), columns, columns, np.array([1.0]), operation="sum")
@@ -0,0 +1,145 @@
+import base64
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import util
+
+
+class GralHandler(BaseHTTPRequestHandler):
+    """Подменный сервер /gralfile с поддержкой ETag, Range/If-Range и Digest"""
+    data = b""
+    digest = None
+    drop_after = None
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests.append(dict(self.headers))
+        etag = f'"{hashlib.sha256(cls.data).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        if self.headers.get("Range") and self.headers.get("If-Range", etag) == etag:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(cls.data) - 1}/{len(cls.data)}")
+        else:
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Digest", cls.digest or "sha-256=" + base64.b64encode(hashlib.sha256(cls.data).digest()).decode())
+        self.send_header("Content-Length", str(len(cls.data) - start))
+        self.end_headers()
+
+        body = cls.data[start:]
+        if cls.drop_after is not None:
+            body = body[:cls.drop_after]
+            cls.drop_after = None
+            self.wfile.write(body)
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(util.time, "sleep", lambda _: None)
+    handler = type("Handler", (GralHandler,), {"data": os.urandom(1_000_000), "requests": []})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield handler, f"http://127.0.0.1:{httpd.server_port}/gralfile"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_resumes_after_dropped_connection(server, tmp_path):
+    handler, url = server
+    handler.drop_after = 300_000
+    path = str(tmp_path / "gralfile.zip")
+
+    assert util.download_file(url, path) is True
+    with open(path, 'rb') as file:
+        assert file.read() == handler.data
+    assert handler.requests[-1]["Range"] == "bytes=300000-"
+    assert not os.path.exists(f"{path}.part")
+
+
+def test_download_skipped_when_not_modified(server, tmp_path):
+    handler, url = server
+    path = str(tmp_path / "gralfile.zip")
+
+    assert util.download_file(url, path) is True
+    assert util.download_file(url, path) is False
+    assert "If-None-Match" in handler.requests[-1]
+
+    handler.data = os.urandom(1000)
+    assert util.download_file(url, path) is True
+    with open(path, 'rb') as file:
+        assert file.read() == handler.data
+
+
+def test_corrupted_cache_is_downloaded_again(server, tmp_path):
+    handler, url = server
+    path = str(tmp_path / "gralfile.zip")
+
+    util.download_file(url, path)
+    with open(path, 'r+b') as file:
+        file.write(b"\0" * 16)
+
+    assert util.download_file(url, path) is True
+    assert "If-None-Match" not in handler.requests[-1]
+    with open(path, 'rb') as file:
+        assert file.read() == handler.data
+
+
+def test_digest_mismatch_raises(server, tmp_path):
+    handler, url = server
+    handler.digest = "sha-256=" + base64.b64encode(hashlib.sha256(b"other").digest()).decode()
+    path = str(tmp_path / "gralfile.zip")
+
+    with pytest.raises(IOError, match="Checksum mismatch"):
+        util.download_file(url, path)
+    assert not os.path.exists(path)
+    assert not os.path.exists(f"{path}.part")
+
+
+def test_malformed_digest_is_ignored(server, tmp_path):
+    handler, url = server
+    handler.digest = "sha-256=not base64!"
+    path = str(tmp_path / "gralfile.zip")
+
+    assert util.download_file(url, path) is True
+    with open(path, 'rb') as file:
+        assert file.read() == handler.data
+
+
+def test_concurrent_downloads_do_not_share_part_file(server, tmp_path):
+    handler, url = server
+    handler.drop_after = 300_000
+    path = str(tmp_path / "gralfile.zip")
+    barrier = threading.Barrier(2)
+
+    def download():
+        barrier.wait()
+        return util.download_file(url, path)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(lambda _: download(), range(2)))
+
+    # Второй вызов ждёт блокировку и получает уже скачанный архив через 304
+    assert sorted(results) == [False, True]
+    with open(path, 'rb') as file:
+        assert file.read() == handler.data
+    assert not os.path.exists(f"{path}.part")
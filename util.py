@@ -1,8 +1,19 @@
+import base64
+import binascii
+import fcntl
+import hashlib
+import json
+import os
 import re
+import time
+from contextlib import contextmanager
 from typing import Final
 
 import requests
 from pandas import DataFrame
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from urllib3.util.retry import Retry
 
 cadastre_original_headers = [
     "x","y","z","dx","dy","dz","H2S[kg/h]","--","--","--",
@@ -37,10 +48,220 @@ timestamp_regex = re.compile(r'soft/Project/Computation/\d{5}-\d+\.txt')
 MSK_48_CRS: Final[
     str] = '+proj=tmerc +lat_0=0 +lon_0=38.48333333333 +k=1 +x_0=1250000 +y_0=-5412900.566 +ellps=krass +towgs84=23.57,-140.95,-79.8,0,0.35,0.79,-0.22 +units=m +no_defs'
 
-def download_file(url, f):
-    r = requests.get(url, stream=True)
-    for chunk in r.iter_content(chunk_size=16 * 1024):
+MIN_CHUNK_SIZE: Final[int] = 64 * 1024
+MAX_CHUNK_SIZE: Final[int] = 4 * 1024 * 1024
+
+# Общая сессия с пулом соединений: повторные запросы к GRAL переиспользуют TCP-соединение
+http_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, connect=3, read=0, backoff_factor=0.5,
+                      status_forcelist=(502, 503, 504), allowed_methods=("GET", "HEAD"))
+)
+http_session.mount("http://", _adapter)
+http_session.mount("https://", _adapter)
+
+
+def _read_meta(path: str) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(path: str, meta: dict):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(meta, file)
+
+
+def _response_meta(r: requests.Response) -> dict:
+    return {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+
+
+def _same_version(meta: dict, r: requests.Response) -> bool:
+    remote = _response_meta(r)
+    if remote["etag"] and meta.get("etag"):
+        return remote["etag"] == meta["etag"]
+    if remote["last_modified"] and meta.get("last_modified"):
+        return remote["last_modified"] == meta["last_modified"]
+    return False
+
+
+def _expected_sha256(r: requests.Response) -> str | None:
+    """Хэш sha-256 из заголовка Digest (RFC 3230), если сервер его прислал. Некорректное значение игнорируется"""
+    for item in r.headers.get("Digest", "").split(","):
+        algorithm, _, value = item.strip().partition("=")
+        if algorithm.lower() == "sha-256" and value:
+            try:
+                return base64.b64decode(value, validate=True).hex()
+            except binascii.Error:
+                return None
+    return None
+
+
+def _update_from_file(hasher, path: str):
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(MAX_CHUNK_SIZE), b''):
+            hasher.update(block)
+
+
+def _is_intact(path: str, meta: dict) -> bool:
+    """Совпадают ли размер и sha-256 файла с сохранёнными в метаданных"""
+    if os.path.getsize(path) != meta.get("size"):
+        return False
+    hasher = hashlib.sha256()
+    _update_from_file(hasher, path)
+    return hasher.hexdigest() == meta.get("sha256")
+
+
+def _total_size(r: requests.Response, offset: int) -> int | None:
+    if r.status_code == 206:
+        total = r.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = r.headers.get("Content-Length")
+    return offset + int(length) if length and length.isdigit() else None
+
+
+def _stream_to_file(r: requests.Response, f, hasher):
+    """
+    Запись тела ответа в файл с адаптивным размером блока: блок удваивается, пока чтение идёт быстро,
+    и уменьшается вдвое на медленном соединении
+    """
+    chunk_size = MIN_CHUNK_SIZE
+    while True:
+        started = time.monotonic()
+        chunk = r.raw.read(chunk_size)
+        if not chunk:
+            break
         f.write(chunk)
+        hasher.update(chunk)
+        elapsed = time.monotonic() - started
+        if elapsed < 0.25:
+            chunk_size = min(chunk_size * 2, MAX_CHUNK_SIZE)
+        elif elapsed > 1.0:
+            chunk_size = max(chunk_size // 2, MIN_CHUNK_SIZE)
+
+
+@contextmanager
+def file_lock(path: str, exclusive: bool = True):
+    """
+    Межпроцессная блокировка файла path через flock на {path}.lock.
+    Исключительная — для записи (скачивание), разделяемая — для чтения (распаковка архива)
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def download_file(url: str,
+                  path: str,
+                  timeout: tuple[float, float] = (10, 60),
+                  max_attempts: int = 5) -> bool:
+    """
+    Скачивание файла по URL в path с докачкой и проверкой целостности.
+    Рядом с файлом хранится {path}.meta с ETag/Last-Modified и sha-256 скачанной версии:
+        - если версия на сервере не изменилась (304 или совпадающий ETag), а размер и sha-256 локальной копии
+          совпадают с сохранёнными, скачивание пропускается
+        - незавершённая загрузка пишется в {path}.part и продолжается запросом Range после обрыва
+        - если сервер прислал Digest: sha-256, итоговый файл сверяется с ним
+    На время скачивания берётся исключительная блокировка file_lock(path): воркеры gunicorn
+    не пишут в один и тот же {path}.part одновременно
+
+    Parameters
+    ----------
+    url - Адрес файла
+    path - Путь, по которому сохраняется файл
+    timeout - Таймауты соединения и чтения, в секундах
+    max_attempts - Количество попыток докачки при обрыве соединения
+
+    Returns
+    -------
+    True, если файл был скачан заново, False, если локальная копия актуальна
+    """
+    with file_lock(path):
+        return _download_file(url, path, timeout, max_attempts)
+
+
+def _download_file(url: str, path: str, timeout: tuple[float, float], max_attempts: int) -> bool:
+    meta_path = f"{path}.meta"
+    part_path = f"{path}.part"
+    part_meta_path = f"{part_path}.meta"
+
+    meta = _read_meta(meta_path) if os.path.exists(path) else {}
+    if meta and not _is_intact(path, meta):
+        # Локальная копия повреждена: условный запрос не отправляется, файл скачивается заново
+        meta = {}
+    part_meta = _read_meta(part_meta_path) if os.path.exists(part_path) else {}
+
+    for attempt in range(max_attempts):
+        offset = os.path.getsize(part_path) if part_meta else 0
+        # Без сжатия: смещения Range и Content-Length считаются в байтах самого файла
+        headers = {"Accept-Encoding": "identity"}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        elif meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            # If-Range: сервер отдаст файл целиком, если он изменился с начала прерванной загрузки
+            validator = part_meta.get("etag") or part_meta.get("last_modified")
+            if validator:
+                headers["If-Range"] = validator
+
+        try:
+            with http_session.get(url, headers=headers, stream=True, timeout=timeout) as r:
+                if r.status_code == 304 or (r.status_code == 200 and meta and _same_version(meta, r)):
+                    return False
+                if r.status_code == 416:
+                    # Часть файла не соответствует серверной версии, начинаем заново
+                    os.remove(part_path)
+                    part_meta = {}
+                    continue
+                r.raise_for_status()
+
+                if r.status_code != 206:
+                    offset = 0
+                    part_meta = _response_meta(r)
+                    _write_meta(part_meta_path, part_meta)
+
+                hasher = hashlib.sha256()
+                if offset:
+                    _update_from_file(hasher, part_path)
+
+                expected_size = _total_size(r, offset)
+                expected_sha256 = _expected_sha256(r)
+                with open(part_path, 'ab' if offset else 'wb') as f:
+                    _stream_to_file(r, f, hasher)
+        except (requests.ConnectionError, requests.Timeout, Urllib3HTTPError):
+            if attempt == max_attempts - 1:
+                raise
+            time.sleep(min(2 ** attempt, 30))
+            continue
+
+        size = os.path.getsize(part_path)
+        if expected_size is not None and size < expected_size:
+            # Соединение закрыто раньше времени, докачиваем оставшееся
+            continue
+
+        digest = hasher.hexdigest()
+        if (expected_size is not None and size != expected_size) \
+                or (expected_sha256 is not None and digest != expected_sha256):
+            os.remove(part_path)
+            os.remove(part_meta_path)
+            raise IOError(f"Checksum mismatch for {url}: got {size} bytes, sha-256 {digest}")
+
+        os.replace(part_path, path)
+        os.remove(part_meta_path)
+        _write_meta(meta_path, {**part_meta, "sha256": digest, "size": size})
+        return True
+
+    raise IOError(f"Failed to download {url} after {max_attempts} attempts")
 
 def normalize_columns(df: DataFrame):
     """Привести названия колонок CSV к именам полей моделей"""